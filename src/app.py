@@ -1,16 +1,31 @@
 import dash
 from dash import dcc, html, Input, Output, State
 from dash.exceptions import PreventUpdate
+from flask.json.provider import JSONProvider
+import orjson
 import pandas as pd
-from scipy.optimize import linprog
-import base64
+import numpy as np
+from numba import njit, prange
+import pybase64
+import msgpack
+import hashlib
 import io
-import plotly.graph_objects as go
-import plotly.express as px
+import os
+import threading
+from collections import OrderedDict
+
+# Decode callback requests with orjson; Dash already encodes responses with it when installed
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize the Dash app
 app = dash.Dash(__name__)
 server = app.server
+server.json = ORJSONProvider(server)
 
 # Define the layout of the app
 app.layout = html.Div([
@@ -82,69 +97,175 @@ app.layout = html.Div([
     ], style={'margin-top': '20px'}),
     
     # Graph output
-    dcc.Graph(id='patterns-graph')
+    dcc.Graph(id='patterns-graph'),
+
+    # Optimization results shared between the compute and plot callbacks
+    dcc.Store(id='patterns-store')
 ])
 
-# Define the knapsack problem
-def knapsack(weights, values, capacity):
-    n = len(weights)
-    c = [-v for v in values]  # Objective function (minimization problem)
-    A_ub = [weights]
-    b_ub = [capacity]
-    bounds = [(0, 1) for _ in range(n)]  # Items are either in or out (0 or 1)
-
-    # Solve the knapsack problem
-    result = linprog(c, A_ub=A_ub, b_ub=b_ub, bounds=bounds, method='highs')
-    if result.success:
-        return -result.fun, result.x
-    else:
-        raise ValueError("Optimization failed")
+# Greedy LP relaxation: whole items up to the binary-searched split, then a fraction of the next one
+@njit(cache=True)
+def lp_bound(w_sorted, v_sorted, cumw, cumv, level, value, room):
+    n = len(w_sorted)
+    base_w = cumw[level - 1] if level > 0 else 0
+    base_v = cumv[level - 1] if level > 0 else 0
+    k = np.searchsorted(cumw, base_w + room, side='right')
+    if k == n:
+        return value + cumv[n - 1] - base_v
+    fit_w = (cumw[k - 1] if k > 0 else 0) - base_w
+    fit_v = (cumv[k - 1] if k > 0 else 0) - base_v
+    return value + fit_v + v_sorted[k] * (room - fit_w) / w_sorted[k]
+
+# Solve the 0/1 knapsack problem by branch-and-bound over items presorted by value per unit width
+@njit(cache=True)
+def knapsack_bnb(w_sorted, v_sorted, cumw, cumv, capacity, split):
+    n = len(w_sorted)
+    best_taken = np.zeros(n, dtype=np.bool_)
+    best_taken[:split] = True  # Warm start from the greedy prefix
+    if split == n:
+        return cumv[n - 1], best_taken  # Every order fits
+    best_value = cumv[split - 1] if split > 0 else 0
+
+    # Depth-first search; each stack row is (level, value, remaining width, took item level - 1)
+    path = np.zeros(n, dtype=np.bool_)  # Decisions along the current branch, indexed by depth
+    stack = np.empty((2 * n + 1, 4), dtype=np.int64)
+    stack[0, 0] = 0
+    stack[0, 1] = 0
+    stack[0, 2] = capacity
+    stack[0, 3] = 0
+    top = 1
+    while top > 0:
+        top -= 1
+        level = stack[top, 0]
+        value = stack[top, 1]
+        room = stack[top, 2]
+        if level > 0:
+            path[level - 1] = stack[top, 3] == 1
+        if value > best_value:
+            best_value = value
+            best_taken[:level] = path[:level]
+            best_taken[level:] = False
+        if level == n or lp_bound(w_sorted, v_sorted, cumw, cumv, level, value, room) <= best_value:
+            continue
+        # Push the skip branch first so the take branch is explored first
+        stack[top, 0] = level + 1
+        stack[top, 1] = value
+        stack[top, 2] = room
+        stack[top, 3] = 0
+        top += 1
+        if w_sorted[level] <= room:
+            stack[top, 0] = level + 1
+            stack[top, 1] = value + v_sorted[level]
+            stack[top, 2] = room - w_sorted[level]
+            stack[top, 3] = 1
+            top += 1
+
+    return best_value, best_taken
+
+# Solve the knapsack for every coil width in parallel; returns the taken items of each width by row
+@njit(parallel=True, cache=True)
+def solve_coils(coil_widths, w_sorted, v_sorted, cumw, cumv):
+    taken = np.zeros((len(coil_widths), len(w_sorted)), dtype=np.bool_)
+    for i in prange(len(coil_widths)):
+        # The greedy LP split is a binary search over the cumulative widths
+        split = np.searchsorted(cumw, coil_widths[i], side='right')
+        value, taken[i, :] = knapsack_bnb(w_sorted, v_sorted, cumw, cumv, coil_widths[i], split)
+    return taken
+
+# The default workqueue threading layer cannot run parallel kernels from two threads at once
+solve_lock = threading.Lock()
+
+# Compile the solver at import so the first optimization runs the compiled path
+_w = np.array([3, 2], dtype=np.int64)
+_v = np.array([4, 2], dtype=np.int64)
+solve_coils(np.array([4], dtype=np.int64), _w, _v, np.cumsum(_w), np.cumsum(_v))
 
 # Define the function to optimize slitting patterns
-def optimize_slitting_patterns(coils, orders):
-    patterns = []
-    for coil in coils:
-        coil_width, coil_length = coil
-        widths = [order[0] for order in orders]
-        lengths = [order[1] for order in orders]
-        values = lengths  # The value is the length to satisfy
-        weights = widths   # The weight is the width of the order
-        capacity = coil_width
-        
-        # Solve the knapsack problem
-        value, x = knapsack(weights, values, capacity)
-        pattern = [widths[i] for i in range(len(x)) if x[i] > 0.5]
-        patterns.append((coil, pattern))
-    
-    return patterns
-
-# Define the function to minimize shear adjustments
-def minimize_shear_adjustments(patterns):
-    adjusted_patterns = []
-    for pattern in patterns:
-        coil, cuts = pattern
-        sorted_cuts = sorted(cuts)
-        adjusted_patterns.append((coil, sorted_cuts))
-    
-    return adjusted_patterns
+def optimize_slitting_patterns(coils, w_sorted, v_sorted, cumw):
+    cumv = np.cumsum(v_sorted)
+    total_width = w_sorted.sum()
+    min_width = w_sorted.min() if len(w_sorted) else 0
+    all_orders = np.sort(w_sorted).tolist()
+
+    # Coils of the same width share the same pattern, so solve each distinct width once
+    coil_widths, inverse = np.unique(coils[:, 0], return_inverse=True)
+
+    # Only coils that fit some but not all orders need the knapsack
+    needs_solve = (coil_widths < total_width) & (coil_widths >= min_width)
+    with solve_lock:
+        solved = iter(solve_coils(coil_widths[needs_solve], w_sorted, v_sorted, cumw, cumv))
+
+    width_patterns = []
+    for coil_width in coil_widths:
+        if total_width <= coil_width:
+            width_patterns.append(all_orders)  # Every order fits
+        elif min_width > coil_width:
+            width_patterns.append([])  # No order fits
+        else:
+            width_patterns.append(np.sort(w_sorted[next(solved)]).tolist())  # Sorted cuts minimize shear adjustments
+
+    return [(tuple(coil), width_patterns[k]) for coil, k in zip(coils.tolist(), inverse)]
+
+# Digest of an upload's base64 payload, used as the parse cache key
+def content_key(content_string):
+    if isinstance(content_string, str):
+        content_string = content_string.encode()
+    return hashlib.blake2b(content_string).hexdigest()
+
+# The default files offered for download never change, so parse them once at startup
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+DEFAULT_COILS_PATH = os.path.join(ASSETS_DIR, 'inventory.xlsx')
+DEFAULT_ORDERS_PATH = os.path.join(ASSETS_DIR, 'order.xlsx')
+default_files = {}
+for path in (DEFAULT_COILS_PATH, DEFAULT_ORDERS_PATH):
+    with open(path, 'rb') as f:
+        default_files[content_key(pybase64.b64encode(f.read()))] = pd.read_excel(path, engine='calamine')
+
+# Parsed uploads keyed by a digest of their contents, so repeated uploads skip the Excel parse
+parsed_files = OrderedDict()  # Least recently used first
+PARSED_FILES_MAX = 8
+parsed_files_lock = threading.Lock()  # The dev server handles callbacks on several threads
+
+# Function to decode and parse file contents
+def parse_file(contents):
+    content_type, content_string = contents.split(',')
+    key = content_key(content_string)
+    if key in default_files:
+        return default_files[key]
+    with parsed_files_lock:
+        if key in parsed_files:
+            parsed_files.move_to_end(key)
+            return parsed_files[key]
+    decoded = pybase64.b64decode(content_string, validate=False)
+    df = pd.read_excel(io.BytesIO(decoded), engine='calamine')
+    with parsed_files_lock:
+        parsed_files[key] = df
+        if len(parsed_files) > PARSED_FILES_MAX:
+            parsed_files.popitem(last=False)  # Drop the least recently used entry
+    return df
+
+# Convert a (width, length) sheet to int64, refusing values the integer solver would truncate
+def whole_number_array(df, name):
+    arr = df.to_numpy(dtype=np.float64)
+    if not np.array_equal(arr, np.floor(arr)):
+        raise ValueError(f"{name} widths and lengths must be whole numbers of mm")
+    return arr.astype(np.int64)
 
 # Define callback to process uploaded files and run optimization
 @app.callback(
     [Output('upload-status', 'children'),
      Output('patterns-output', 'children'),
-     Output('patterns-graph', 'figure'),
+     Output('patterns-store', 'data'),
      Output('pattern-slider', 'max'),
      Output('pattern-slider', 'value')],
     [Input('upload-coils', 'contents'),
      Input('upload-orders', 'contents'),
-     Input('run-button', 'n_clicks'),
-     Input('pattern-slider', 'value'),
-     Input('bar-width-slider', 'value'),
-     Input('bar-height-slider', 'value')],
-    [State('upload-coils', 'filename'),
+     Input('run-button', 'n_clicks')],
+    [State('pattern-slider', 'value'),
+     State('upload-coils', 'filename'),
      State('upload-orders', 'filename')]
 )
-def update_output(coils_file, orders_file, n_clicks, selected_range, bar_width, bar_height, coils_filename, orders_filename):
+def update_output(coils_file, orders_file, n_clicks, selected_range, coils_filename, orders_filename):
     if n_clicks == 0:
         raise PreventUpdate
 
@@ -152,92 +273,124 @@ def update_output(coils_file, orders_file, n_clicks, selected_range, bar_width,
         raise PreventUpdate
 
     try:
-        # Function to decode and parse file contents
-        def parse_file(contents):
-            content_type, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
-            return pd.read_excel(io.BytesIO(decoded))
-
         # Parse uploaded files directly
         coils_df = parse_file(coils_file)
         orders_df = parse_file(orders_file)
         
-        # Convert DataFrame to list of tuples
-        coils = list(coils_df.itertuples(index=False, name=None))
-        orders = list(orders_df.itertuples(index=False, name=None))
+        # Convert DataFrames to (rows, 2) int64 arrays of (width, length)
+        coils = whole_number_array(coils_df, "Coils")
+        orders = whole_number_array(orders_df, "Orders")
+
+        # Sort the orders by value per unit width once for every coil
+        widths = orders[:, 0]
+        lengths = orders[:, 1]
+        order = np.argsort(-lengths / widths, kind='stable')
+        w_sorted = widths[order]
+        v_sorted = lengths[order]
+        cumw = np.cumsum(w_sorted)
         
-        patterns = optimize_slitting_patterns(coils, orders)
-        adjusted_patterns = minimize_shear_adjustments(patterns)
+        patterns = optimize_slitting_patterns(coils, w_sorted, v_sorted, cumw)
         
         def format_pattern(pattern):
             return ' '.join(map(str, pattern))
-        
+
+        # Render the tables as one HTML string rather than a component per cell
+        rows = '\n'.join(f'<tr><td>{pattern[0]}</td><td>{format_pattern(pattern[1])}</td></tr>' for pattern in patterns)
+        table = f'<table>\n<tr><th>Coil (Width(mm), Length(mm)</th><th>Pattern</th></tr>\n{rows}\n</table>'
+
         patterns_output = html.Div([
             html.H2("Patterns Before Shear Adjustment"),
-            html.Table(
-                [html.Tr([html.Th("Coil (Width(mm), Length(mm)"), html.Th("Pattern")])] +
-                [html.Tr([html.Td(str(pattern[0])), html.Td(format_pattern(pattern[1]))]) for pattern in patterns]
-            ),
+            dcc.Markdown(table, dangerously_allow_html=True),
             html.H2("Patterns After Shear Adjustment"),
-            html.Table(
-                [html.Tr([html.Th("Coil (Width(mm), Length(mm)"), html.Th("Pattern")])] +
-                [html.Tr([html.Td(str(pattern[0])), html.Td(format_pattern(pattern[1]))]) for pattern in adjusted_patterns]
-            )
+            dcc.Markdown(table, dangerously_allow_html=True)
         ])
 
         # Update pattern slider max value
         pattern_slider_max = len(patterns) - 1
         pattern_slider_value = min(selected_range, pattern_slider_max)
-        
-        # Create the graph
-        fig = go.Figure()
-        color_scale = px.colors.qualitative.Plotly  # Use Plotly's qualitative color scale
-
-        # Determine the patterns to display
-        start_index = pattern_slider_value
-        end_index = min(start_index + 10, len(patterns))
-        patterns_to_display = patterns[start_index:end_index]
-
-        for i, pattern in enumerate(patterns_to_display):
-            pattern_widths = pattern[1]
-            for j, width in enumerate(pattern_widths):
-                fig.add_trace(go.Bar(
-                    y=[f'Pattern {start_index + i + 1}'],
-                    x=[width],
-                    name=f'Width {width}',
-                    marker_color=color_scale[j % len(color_scale)],
-                    width=bar_width,  # Set the bar width
-                    orientation='h',  # Horizontal bars
-                    text=[f'{width}'],  # Display size inside the bar
-                    textposition='inside'  # Place text inside the bars
-                ))
-
-        fig.update_layout(
-            title='Sizes Within Each Pattern',
-            xaxis_title='Width (mm)',
-            yaxis_title='Pattern',
-            barmode='stack',
-            xaxis=dict(
-                title='Width',
-                tickmode='linear',
-                tick0=0,
-                dtick=5,  # Adjust as needed for scale-like behavior
-                tickvals=[i for i in range(0, max(max(widths) for coil, widths in patterns) + 10, 5)],  # Set x-axis tick values
-                ticktext=[str(i) for i in range(0, max(max(widths) for coil, widths in patterns) + 10, 5)]  # Set x-axis tick text
-            ),
-            yaxis=dict(
-                title='Pattern',
-                tickvals=[f'Pattern {i+1}' for i in range(len(patterns_to_display))],
-                ticktext=[f'Pattern {i+1}' for i in range(len(patterns_to_display))]
-            ),
-            height=600 * bar_height  # Adjust height based on bar height
-        )
 
-        # Return the updated graph and other outputs
-        return "Files successfully uploaded and processed.", patterns_output, fig, pattern_slider_max, pattern_slider_value
+        # Store the patterns as an opaque base64 msgpack string rather than nested JSON lists
+        patterns_data = pybase64.b64encode(msgpack.packb(patterns)).decode()
+
+        return "Files successfully uploaded and processed.", patterns_output, patterns_data, pattern_slider_max, pattern_slider_value
 
     except Exception as e:
-        return f"An error occurred: {e}", "", go.Figure(), 0, 0  # Return an empty figure on error
+        return f"An error occurred: {e}", "", None, 0, 0
+
+# Define callback to draw the stored patterns, so slider changes do not rerun the optimization
+@app.callback(
+    Output('patterns-graph', 'figure'),
+    [Input('patterns-store', 'data'),
+     Input('pattern-slider', 'value'),
+     Input('bar-width-slider', 'value'),
+     Input('bar-height-slider', 'value')]
+)
+def update_graph(patterns_data, selected_range, bar_width, bar_height):
+    if not patterns_data:
+        return {'data': [], 'layout': {}}  # Empty figure until an optimization succeeds
+    patterns = msgpack.unpackb(pybase64.b64decode(patterns_data))
+
+    # Plotly colors are only needed once there is something to draw, so keep them off the startup path
+    from plotly.colors import qualitative
+    color_scale = qualitative.Plotly  # Use Plotly's qualitative color scale
+
+    # Determine the patterns to display
+    start_index = min(selected_range, len(patterns) - 1)
+    end_index = min(start_index + 10, len(patterns))
+    patterns_to_display = patterns[start_index:end_index]
+
+    # Group the cuts by their position in the pattern, so each stack keeps the cut order
+    by_position = []
+    for i, pattern in enumerate(patterns_to_display):
+        pattern_widths = pattern[1]
+        for j, width in enumerate(pattern_widths):
+            if j == len(by_position):
+                by_position.append({'y': [], 'x': [], 'text': []})
+            by_position[j]['y'].append(f'Pattern {start_index + i + 1}')
+            by_position[j]['x'].append(width)
+            by_position[j]['text'].append(f'{width}')
+
+    # X-axis ticks every 5 mm up to just past the widest cut
+    max_width = max((max(widths) for coil, widths in patterns if widths), default=0) + 10
+    ticks = np.arange(0, max_width, 5)
+
+    # Build the figure as a plain dict, which Dash serializes without plotly's per-trace validation
+    fig = {
+        'data': [
+            {
+                'type': 'bar',
+                'y': cuts['y'],
+                'x': cuts['x'],
+                'marker': {'color': color_scale[j % len(color_scale)]},
+                'width': bar_width,  # Set the bar width
+                'orientation': 'h',  # Horizontal bars
+                'text': cuts['text'],  # Display size inside the bar
+                'textposition': 'inside',  # Place text inside the bars
+                'showlegend': False
+            }
+            for j, cuts in enumerate(by_position)
+        ],
+        'layout': {
+            'title': {'text': 'Sizes Within Each Pattern'},
+            'barmode': 'stack',
+            'xaxis': {
+                'title': {'text': 'Width'},
+                'tickmode': 'linear',
+                'tick0': 0,
+                'dtick': 5,  # Adjust as needed for scale-like behavior
+                'tickvals': ticks.tolist(),  # Set x-axis tick values
+                'ticktext': ticks.astype(str).tolist()  # Set x-axis tick text
+            },
+            'yaxis': {
+                'title': {'text': 'Pattern'},
+                'tickvals': [f'Pattern {i+1}' for i in range(len(patterns_to_display))],
+                'ticktext': [f'Pattern {i+1}' for i in range(len(patterns_to_display))]
+            },
+            'height': 600 * bar_height  # Adjust height based on bar height
+        }
+    }
+
+    return fig
 
 # Run the app
 if __name__ == '__main__':